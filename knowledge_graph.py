@@ -1,40 +1,107 @@
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from bs4 import BeautifulSoup
-from py2neo import Graph, Node, Relationship
-from flask import Flask, jsonify
+from cachetools import TTLCache
+from py2neo import Graph, Relationship
+from flask import Flask, jsonify, request
+
+# Single shared Graph, opened on first use so importing this module does no network I/O
+graph = None
+graph_lock = threading.Lock()
+
+def get_graph():
+    global graph
+    with graph_lock:
+        if graph is None:
+            graph = Graph("bolt://localhost:7687", auth=("neo4j", "advancedalgo"))
+    return graph
+
+# Shared HTTP session so PubMed and TCIA connections are pooled and transient failures retried
+REQUEST_TIMEOUT = 10  # seconds
+session = requests.Session()
+adapter = HTTPAdapter(pool_connections=4,
+                      max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504],
+                                        raise_on_status=False))
+session.mount("https://", adapter)
+
+# Parameterized queries so Neo4j can reuse cached execution plans
+Q_STAGES = "MATCH (s:TumorStage) WHERE s.source=$src RETURN s.name AS Stage, s.url AS Source"
+Q_REGIONS = "MATCH (b:BrainRegion) WHERE b.source=$src RETURN b.name AS Region"
+Q_DATASETS = "MATCH (d:Dataset) WHERE d.source=$src RETURN d.name AS Dataset"
+
+# Batched inserts: one round-trip per store_* call instead of one per node
+Q_CREATE_STAGES = "UNWIND $rows AS r CREATE (:TumorStage {name: r.name, source: 'PubMed', url: r.url})"
+Q_CREATE_REGIONS = "UNWIND $rows AS r CREATE (:BrainRegion {name: r.name, source: 'SNOMED CT'})"
+Q_CREATE_DATASETS = "UNWIND $rows AS r CREATE (:Dataset {name: r.name, source: 'TCIA'})"
+
+# Cache of endpoint results. The store_* functions run in a separate --seed process,
+# so the 60 s TTL is the only bound on how stale a served result can be.
+cache = TTLCache(maxsize=64, ttl=60)
+cache_lock = threading.Lock()
+cache_stats = {"hits": 0, "misses": 0}
+
+def cached_query(key, query, **params):
+    with cache_lock:
+        if key in cache:
+            cache_stats["hits"] += 1
+            return cache[key]
+        cache_stats["misses"] += 1
+
+    results = get_graph().run(query, **params).data()
+    with cache_lock:
+        cache[key] = results
+    return results
+
+# Index the source property used by every lookup so MATCH ... WHERE source avoids label scans
+INDEXES = [
+    "CREATE INDEX stage_source IF NOT EXISTS FOR (s:TumorStage) ON (s.source)",
+    "CREATE INDEX region_source IF NOT EXISTS FOR (b:BrainRegion) ON (b.source)",
+    "CREATE INDEX dataset_source IF NOT EXISTS FOR (d:Dataset) ON (d.source)",
+]
 
-graph = Graph("bolt://localhost:7687", auth=("neo4j", "advancedalgo"))
+def create_indexes():
+    graph = get_graph()
+    for index in INDEXES:
+        graph.run(index)
 
 def scrape_tumor_size_thresholds():
     url = "https://pubmed.ncbi.nlm.nih.gov/?term=glioma+tumor+size+classification"
     headers = {"User-Agent": "Mozilla/5.0"}
-    response = requests.get(url, headers=headers)
+    try:
+        response = session.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+    except requests.RequestException:
+        print("Error accessing PubMed")
+        return []
 
     if response.status_code != 200:
         print("Error accessing PubMed")
         return []
 
-    soup = BeautifulSoup(response.text, "html.parser")
-    articles = soup.find_all("a", class_="docsum-title")
+    soup = BeautifulSoup(response.text, "lxml")
+    articles = soup.select("a.docsum-title", limit=5)  # First 5 papers, stops matching early
 
     thresholds = []
-    for article in articles[:5]:  # First 5 papers
+    for article in articles:
         title = article.text.strip()
         link = "https://pubmed.ncbi.nlm.nih.gov" + article['href']
         thresholds.append((title, link))
 
     return thresholds
 
-def store_tumor_classifications():
-    thresholds = scrape_tumor_size_thresholds()
+def store_tumor_classifications(thresholds):
+    rows = [{"name": title, "url": link} for title, link in thresholds]
+    graph = get_graph()
+    tx = graph.begin()
+    tx.run(Q_CREATE_STAGES, rows=rows)
+    graph.commit(tx)
 
     for title, link in thresholds:
-        classification_node = Node("TumorStage", name=title, source="PubMed", url=link)
-        graph.create(classification_node)
         print(f"Stored Tumor Classification: {title}")
 
-store_tumor_classifications()
-
 
 brain_regions = [
     "Frontal Lobe", "Temporal Lobe", "Occipital Lobe", "Parietal Lobe",
@@ -42,16 +109,22 @@ brain_regions = [
 ]
 
 def store_brain_regions():
+    rows = [{"name": region} for region in brain_regions]
+    graph = get_graph()
+    tx = graph.begin()
+    tx.run(Q_CREATE_REGIONS, rows=rows)
+    graph.commit(tx)
+
     for region in brain_regions:
-        brain_node = Node("BrainRegion", name=region, source="SNOMED CT")
-        graph.create(brain_node)
         print(f"Stored Brain Region: {region}")
 
-store_brain_regions()
-
 def get_tcia_glioma_datasets():
     url = "https://services.cancerimagingarchive.net/nbia-api/services/v1/getCollectionValues"
-    response = requests.get(url)
+    try:
+        response = session.get(url, timeout=REQUEST_TIMEOUT)
+    except requests.RequestException:
+        print("Error fetching TCIA datasets")
+        return None
 
     if response.status_code == 200:
         return response.json()  # Returns a list of dataset names
@@ -59,62 +132,80 @@ def get_tcia_glioma_datasets():
         print("Error fetching TCIA datasets")
         return None
 
-def store_tcia_data():
-    datasets = get_tcia_glioma_datasets()
+def store_tcia_data(datasets):
     if not datasets:
         return
     
-    for dataset in datasets[:5]:  # Limit to 5 for simplicity
-        dataset_name = str(dataset)  # Ensure value is stored as a string
-        dataset_node = Node("Dataset", name=dataset_name, source="TCIA")
-        graph.create(dataset_node)
+    dataset_names = [str(dataset) for dataset in datasets[:5]]  # Limit to 5, stored as strings
+    rows = [{"name": name} for name in dataset_names]
+    graph = get_graph()
+    tx = graph.begin()
+    tx.run(Q_CREATE_DATASETS, rows=rows)
+    graph.commit(tx)
+
+    for dataset_name in dataset_names:
         print(f"Stored MRI Dataset: {dataset_name}")
 
-store_tcia_data()
-
-
-def classify_tumor_with_verified_data(tumor_size):
-    query = """
-    MATCH (s:TumorStage) WHERE s.source='PubMed'
-    RETURN s.name AS Stage, s.url AS Source
+def fetch_external_data():
+    """
+    Runs the PubMed and TCIA requests concurrently, since both are network-bound.
     """
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        thresholds = executor.submit(scrape_tumor_size_thresholds)
+        datasets = executor.submit(get_tcia_glioma_datasets)
+        return thresholds.result(), datasets.result()
 
-    results = graph.run(query)
+def classify_tumor_with_verified_data(tumor_size):
+    results = get_graph().run(Q_STAGES, src="PubMed")
     for record in results:
         print(f"Tumor classified based on: {record['Stage']} - Reference: {record['Source']}")
 
+def seed():
+    """
+    Scrapes the external sources once and stores them in Neo4j.
+    """
+    create_indexes()
+
+    thresholds, datasets = fetch_external_data()
+    store_tumor_classifications(thresholds)
+    store_brain_regions()
+    store_tcia_data(datasets)
 
-classify_tumor_with_verified_data(3.5)
+    classify_tumor_with_verified_data(3.5)
 
 
 app = Flask(__name__)
 
 @app.route('/get_verified_tumor_data', methods=['GET'])
 def get_verified_tumor_data():
-    query = """
-    MATCH (s:TumorStage) WHERE s.source='PubMed'
-    RETURN s.name AS Stage, s.url AS Source
-    """
-    results = graph.run(query).data()
+    results = cached_query(request.path, Q_STAGES, src="PubMed")
     return jsonify(results)
 
 @app.route('/get_verified_brain_regions', methods=['GET'])
 def get_verified_brain_regions():
-    query = """
-    MATCH (b:BrainRegion) WHERE b.source='SNOMED CT'
-    RETURN b.name AS Region
-    """
-    results = graph.run(query).data()
+    results = cached_query(request.path, Q_REGIONS, src="SNOMED CT")
     return jsonify(results)
 
 @app.route('/get_verified_mri_datasets', methods=['GET'])
 def get_verified_mri_datasets():
-    query = """
-    MATCH (d:Dataset) WHERE d.source='TCIA'
-    RETURN d.name AS Dataset
-    """
-    results = graph.run(query).data()
+    results = cached_query(request.path, Q_DATASETS, src="TCIA")
     return jsonify(results)
 
+@app.route('/cache_stats', methods=['GET'])
+def get_cache_stats():
+    with cache_lock:
+        return jsonify(dict(cache_stats, size=len(cache)))
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve verified tumor data from the Neo4j knowledge graph")
+    parser.add_argument("--seed", action="store_true",
+                        help="scrape PubMed/TCIA and store the results in Neo4j, then exit")
+    args = parser.parse_args()
+
+    if args.seed:
+        seed()
+    else:
+        app.run(host='0.0.0.0', port=8080, threaded=True)
+
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=8080)
+    main()
@@ -1,67 +1,233 @@
+import sys
+from typing import NamedTuple
+
 import numpy as np
-import cv2
-import matplotlib.pyplot as plt
-import tifffile as tiff
-from skimage.segmentation import mark_boundaries
 
-# Default pixel spacing assumption (0.5 mm per pixel)
-PIXEL_SPACING = 0.5  # mm per pixel
+# cv2, matplotlib, tifffile and numba are imported inside the functions that use them,
+# so importing this module as a library stays cheap
 
-def determine_lobe(centroid, img_shape):
+prange = range  # replaced by numba.prange when the numba engine is first used
+_numba_kernel = None
+
+# Default pixel spacing assumption (0.5 mm per pixel); float32 is ample precision for mm measurements
+PIXEL_SPACING = np.float32(0.5)  # mm per pixel
+
+def region_thresholds(img_shape):
     """
-    Determines the approximate tumor location based on the centroid position.
-    Assumes a standard axial view MRI.
+    Returns the (w / 2, h / 3, 2h / 3) boundaries used to classify centroids,
+    so they can be computed once per image rather than once per tumor.
     """
     h, w = img_shape[:2]
-    x, y = centroid
+    return w / 2, h / 3, 2 * h / 3
 
+def _classify(x, y, w_half, h_third, h_two_third):
     # Define hemispheres
-    hemisphere = "Left Hemisphere" if x < w / 2 else "Right Hemisphere"
+    hemisphere = "Left Hemisphere" if x < w_half else "Right Hemisphere"
 
     # Define anterior-posterior regions
-    if y < h / 3:
+    if y < h_third:
         region = "Frontal Lobe"
-    elif y < 2 * h / 3:
+    elif y < h_two_third:
         region = "Parietal Lobe"
     else:
         region = "Occipital/Temporal Lobe"
 
     return f"{region} ({hemisphere})"
 
-def extract_tumor_info(binary_mask, img_shape):
+def determine_lobe(centroid, img_shape):
+    """
+    Determines the approximate tumor location based on the centroid position.
+    Assumes a standard axial view MRI.
+    """
+    x, y = centroid
+    return _classify(x, y, *region_thresholds(img_shape))
+
+def determine_lobes(centroids, img_shape):
+    """
+    Vectorized version of determine_lobe for an (N, 2) array of centroids.
+    """
+    w_half, h_third, h_two_third = region_thresholds(img_shape)
+    x, y = centroids[:, 0], centroids[:, 1]
+
+    hemisphere = np.where(x < w_half, "Left Hemisphere", "Right Hemisphere")
+    region = np.select([y < h_third, y < h_two_third],
+                       ["Frontal Lobe", "Parietal Lobe"], default="Occipital/Temporal Lobe")
+
+    return np.char.add(np.char.add(region, " ("), np.char.add(hemisphere, ")"))
+
+# Location names indexed by region code * 2 + hemisphere code (see _tumor_kernel)
+LOCATION_NAMES = np.array([
+    f"{region} ({hemisphere})"
+    for region in ("Frontal Lobe", "Parietal Lobe", "Occipital/Temporal Lobe")
+    for hemisphere in ("Left Hemisphere", "Right Hemisphere")
+])
+
+# One record per tumor, so callers iterate a single contiguous array
+TUMOR_DTYPE = np.dtype([
+    ('size_px', 'i4'), ('size_mm2', 'f4'),
+    ('bx', 'i4'), ('by', 'i4'), ('bw', 'i4'), ('bh', 'i4'),
+    ('cx', 'f4'), ('cy', 'f4'),
+    ('h_mm', 'f4'), ('w_mm', 'f4'),
+    ('location', 'U48'),
+])
+
+class TumorStats(NamedTuple):
+    """
+    Per-tumor measurements returned by extract_tumor_info, one entry per connected component.
+    """
+    sizes_px: np.ndarray  # (N,) areas in pixels
+    sizes_mm2: np.ndarray  # (N,) areas in mm²
+    bboxes: np.ndarray  # (N, 4) bounding boxes: (x, y, width, height)
+    centroids: np.ndarray  # (N, 2) centroids (x, y)
+    heights_mm: np.ndarray  # (N,)
+    widths_mm: np.ndarray  # (N,)
+    locations: np.ndarray  # (N,) brain region names
+
+    @classmethod
+    def empty(cls):
+        return cls(np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32), np.empty((0, 4), dtype=np.int32),
+                   np.empty((0, 2)), np.empty(0, dtype=np.float32), np.empty(0, dtype=np.float32),
+                   np.empty(0, dtype=TUMOR_DTYPE['location']))
+
+    def to_records(self):
+        """
+        Packs the per-tumor arrays into a single TUMOR_DTYPE record array.
+        """
+        tumors = np.empty(len(self.sizes_px), dtype=TUMOR_DTYPE)
+        tumors['size_px'] = self.sizes_px
+        tumors['size_mm2'] = self.sizes_mm2
+        tumors['bx'], tumors['by'], tumors['bw'], tumors['bh'] = self.bboxes.T
+        tumors['cx'], tumors['cy'] = self.centroids.T
+        tumors['h_mm'] = self.heights_mm
+        tumors['w_mm'] = self.widths_mm
+        tumors['location'] = self.locations
+        return tumors
+
+def _tumor_kernel(stats, centroids, w_half, h_third, h_two_third, ps):
+    """
+    Computes size (mm²), height/width (mm) and location code for every
+    non-background component in a single pass over stats and centroids.
+    """
+    n = stats.shape[0] - 1
+    sizes_mm2 = np.empty(n, dtype=np.float32)
+    heights_mm = np.empty(n, dtype=np.float32)
+    widths_mm = np.empty(n, dtype=np.float32)
+    location_codes = np.empty(n, dtype=np.int64)
+    area_scale = ps * ps
+
+    for i in prange(n):
+        # stats columns: 0 left, 1 top, 2 width, 3 height, 4 area
+        sizes_mm2[i] = stats[i + 1, 4] * area_scale
+        widths_mm[i] = stats[i + 1, 2] * ps
+        heights_mm[i] = stats[i + 1, 3] * ps
+
+        x = centroids[i + 1, 0]
+        y = centroids[i + 1, 1]
+        hemisphere = np.int64(x >= w_half)
+        region = np.int64(y >= h_third) + np.int64(y >= h_two_third)
+        location_codes[i] = region * 2 + hemisphere
+
+    return sizes_mm2, heights_mm, widths_mm, location_codes
+
+def _get_numba_kernel():
+    """
+    Compiles _tumor_kernel with numba on first use. Returns None if numba is not installed.
+    """
+    global _numba_kernel, prange
+    if _numba_kernel is None:
+        try:
+            import numba
+        except ImportError:  # numba is optional, only needed for engine="numba"
+            return None
+        prange = numba.prange
+        _numba_kernel = numba.njit(parallel=True, fastmath=True, cache=True)(_tumor_kernel)
+    return _numba_kernel
+
+def extract_tumor_info(binary_mask, img_shape, engine="numpy", crop_box=None):
     """
     Extracts tumor size, location, height, width, and determines its brain region.
+    Returns a TumorStats of per-tumor arrays; use .to_records() for a single record array.
+    binary_mask must already be binarized to uint8 (0/1) by the caller.
+    crop_box is the cv2.boundingRect of binary_mask, if the caller already has it.
+    engine is "numpy" or "numba". With "numba" the per-component arithmetic runs in a
+    compiled kernel, falling back to NumPy when numba is not installed. The first call
+    compiles the kernel (cached on disk afterwards) and it is only marginally faster than
+    NumPy, so it only pays off for long-running batch use.
     """
-    binary_mask = (binary_mask > 0.5).astype(np.uint8)  # Ensure binary format
+    import cv2
+
+    if engine not in ("numpy", "numba"):
+        raise ValueError(f"Unknown engine {engine!r}, expected 'numpy' or 'numba'")
 
-    # Find connected components (tumor regions)
-    num_labels, labels, stats, centroids = cv2.connectedComponentsWithStats(binary_mask)
+    assert binary_mask.dtype == np.uint8, "binary_mask must be a uint8 binary mask"
+
+    # Crop to the tight bounding box of the foreground so labeling skips the background.
+    # The origin is rounded down to even coordinates so Spaghetti's 2x2 block grid, and
+    # therefore its label order, matches labeling the full image.
+    if crop_box is None:
+        crop_box = cv2.boundingRect(binary_mask)
+    x0, y0, crop_w, crop_h = crop_box
+
+    # Nothing to label on an all-background mask
+    if crop_w == 0:
+        return TumorStats.empty()
+
+    x1, y1 = x0 + crop_w, y0 + crop_h
+    x0 &= ~1
+    y0 &= ~1
+    crop = binary_mask[y0:y1, x0:x1]
+
+    # Find connected components (tumor regions) using the Spaghetti (Bolelli) labeling algorithm
+    num_labels, labels, stats, centroids = cv2.connectedComponentsWithStatsWithAlgorithm(
+        crop, connectivity=8, ltype=cv2.CV_32S, ccltype=cv2.CCL_SPAGHETTI)
+
+    # Translate bounding boxes and centroids back to full-image coordinates
+    stats[:, cv2.CC_STAT_LEFT] += x0
+    stats[:, cv2.CC_STAT_TOP] += y0
+    centroids += (x0, y0)
 
     # Ignore background (label 0)
     tumor_sizes_px = stats[1:, cv2.CC_STAT_AREA]  # Areas in pixels
     tumor_bboxes = stats[1:, :4]  # Bounding boxes: (x, y, width, height)
     tumor_centroids = centroids[1:]  # Centroids (x, y)
 
-    # Convert tumor size to mm²
-    tumor_sizes_mm2 = tumor_sizes_px * (PIXEL_SPACING ** 2)
+    kernel = _get_numba_kernel() if engine == "numba" else None
+    if kernel is not None:
+        tumor_sizes_mm2, tumor_heights_mm, tumor_widths_mm, location_codes = kernel(
+            stats, centroids, *region_thresholds(img_shape), PIXEL_SPACING)
+        tumor_locations = LOCATION_NAMES[location_codes]
+    else:
+        # Convert tumor size to mm²
+        tumor_sizes_mm2 = tumor_sizes_px.astype(np.float32) * (PIXEL_SPACING * PIXEL_SPACING)
 
-    # Extract height and width in pixels and mm
-    tumor_heights_px = stats[1:, cv2.CC_STAT_HEIGHT]
-    tumor_widths_px = stats[1:, cv2.CC_STAT_WIDTH]
-    tumor_heights_mm = tumor_heights_px * PIXEL_SPACING
-    tumor_widths_mm = tumor_widths_px * PIXEL_SPACING
+        # Extract height and width in pixels and mm
+        tumor_heights_px = stats[1:, cv2.CC_STAT_HEIGHT]
+        tumor_widths_px = stats[1:, cv2.CC_STAT_WIDTH]
+        tumor_heights_mm = tumor_heights_px.astype(np.float32) * PIXEL_SPACING
+        tumor_widths_mm = tumor_widths_px.astype(np.float32) * PIXEL_SPACING
 
-    # Determine tumor location
-    tumor_locations = [determine_lobe(centroid, img_shape) for centroid in tumor_centroids]
+        # Determine tumor location
+        tumor_locations = determine_lobes(tumor_centroids, img_shape)
 
-    return tumor_sizes_px, tumor_sizes_mm2, tumor_bboxes, tumor_centroids, tumor_heights_mm, tumor_widths_mm, tumor_locations
+    return TumorStats(tumor_sizes_px, tumor_sizes_mm2, tumor_bboxes, tumor_centroids,
+                      tumor_heights_mm, tumor_widths_mm, tumor_locations)
 
 def analyze_mask_tif(mask_path, original_image_path=None):
     """
     Loads a binary segmentation mask from a .tif file and analyzes tumor size, location, height, width, and region.
     """
-    mask = tiff.imread(mask_path)  # Load .tif mask
-    mask = (mask > 0.5).astype(np.uint8)  # Convert to binary
+    import cv2
+    import matplotlib.pyplot as plt
+    import pandas as pd
+    import tifffile as tiff
+
+    # Memory-map the .tif mask so large slides are paged in lazily
+    with tiff.TiffFile(mask_path) as tf:
+        raw_mask = tf.asarray(out='memmap')
+
+    # Convert to binary directly into a uint8 buffer, avoiding a temporary bool array
+    mask = np.empty(raw_mask.shape, dtype=np.uint8)
+    np.greater(raw_mask, 0.5, out=mask)
 
     # Load original MRI image if provided
     if original_image_path:
@@ -69,39 +235,65 @@ def analyze_mask_tif(mask_path, original_image_path=None):
     else:
         img = np.zeros_like(mask)  # If no MRI, use black background
 
+    # Foreground bounding box, shared by labeling and contour tracing
+    crop_box = cv2.boundingRect(mask)
+
     # Extract tumor info
-    tumor_sizes_px, tumor_sizes_mm2, tumor_bboxes, tumor_centroids, tumor_heights_mm, tumor_widths_mm, tumor_locations = extract_tumor_info(mask, img.shape)
+    tumors = extract_tumor_info(mask, img.shape, crop_box=crop_box).to_records()
 
-    fig, ax = plt.subplots(figsize=(6, 6))
-    ax.imshow(img, cmap='gray')
+    # Render everything onto a single uint8 RGB overlay instead of per-tumor Matplotlib artists
+    if img.dtype != np.uint8:
+        img = cv2.normalize(img, None, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8U)
+    overlay = cv2.cvtColor(img, cv2.COLOR_GRAY2RGB) if img.ndim == 2 else img.copy()
 
-    # Overlay segmentation mask (red)
-    img_overlay = mark_boundaries(img, mask, color=(1, 0, 0))
-    ax.imshow(img_overlay, alpha=0.6)
+    # Outline segmentation mask (red), tracing only inside the foreground bounding box
+    x0, y0, crop_w, crop_h = crop_box
+    if crop_w:
+        contours, _ = cv2.findContours(mask[y0:y0 + crop_h, x0:x0 + crop_w], cv2.RETR_EXTERNAL,
+                                       cv2.CHAIN_APPROX_SIMPLE, offset=(x0, y0))
+        cv2.drawContours(overlay, contours, -1, (255, 0, 0), 1)
 
-    for i, (size_px, size_mm2, (x, y, w, h), centroid, h_mm, w_mm, location) in enumerate(
-        zip(tumor_sizes_px, tumor_sizes_mm2, tumor_bboxes, tumor_centroids, tumor_heights_mm, tumor_widths_mm, tumor_locations)):
+    for rec in tumors:
+        x, y, w, h = int(rec['bx']), int(rec['by']), int(rec['bw']), int(rec['bh'])
 
         # Draw bounding box
-        rect = plt.Rectangle((x, y), w, h, edgecolor='red', linewidth=2, fill=False)
-        ax.add_patch(rect)
+        cv2.rectangle(overlay, (x, y), (x + w, y + h), (255, 0, 0), 2)
 
         # Mark centroid
-        ax.scatter(centroid[0], centroid[1], color='yellow', marker='x', s=100)
+        cv2.drawMarker(overlay, (int(rec['cx']), int(rec['cy'])), (255, 255, 0),
+                       markerType=cv2.MARKER_TILTED_CROSS, markerSize=10, thickness=2)
 
-        # Display tumor size, height, width, and location
-        ax.text(x, y - 10, f"Size: {size_mm2:.2f} mm²\nH: {h_mm:.2f} mm, W: {w_mm:.2f} mm\n{location}",
-                color='red', fontsize=10, weight='bold')
+        # Display tumor size, height, width, and location above the bounding box
+        lines = [f"Size: {rec['size_mm2']:.2f} mm^2", f"H: {rec['h_mm']:.2f} mm, W: {rec['w_mm']:.2f} mm", str(rec['location'])]
+        for j, line in enumerate(reversed(lines)):
+            cv2.putText(overlay, line, (x, y - 4 - 12 * j), cv2.FONT_HERSHEY_SIMPLEX,
+                        0.35, (255, 0, 0), 1, cv2.LINE_AA)
 
+    plt.figure(figsize=(6, 6))
+    plt.imshow(overlay)
     plt.title("Tumor Analysis from TIFF Mask")
     plt.axis('off')
     plt.show()
 
-    # Print tumor details
-    for i, (size_px, size_mm2, h_mm, w_mm, location) in enumerate(zip(tumor_sizes_px, tumor_sizes_mm2, tumor_heights_mm, tumor_widths_mm, tumor_locations)):
-        print(f"Tumor {i+1}: {size_px} pixels, {size_mm2:.2f} mm², Height: {h_mm:.2f} mm, Width: {w_mm:.2f} mm, Location: {location}")
+    # Print tumor details as one table (CSV when output is not a terminal)
+    details = pd.DataFrame({
+        "Pixels": tumors['size_px'],
+        "Size (mm²)": tumors['size_mm2'],
+        "Height (mm)": tumors['h_mm'],
+        "Width (mm)": tumors['w_mm'],
+        "Location": tumors['location'],
+    }, index=pd.RangeIndex(1, len(tumors) + 1, name="Tumor"))
+
+    if sys.stdout.isatty():
+        print(details.to_string(float_format="%.2f"))
+    else:
+        details.to_csv(sys.stdout, float_format="%.2f")
+
+def main():
+    # Example usage
+    mask_tif_path = "tumor_mask.tif"  # Replace with actual .tif mask path
+    original_mri_tif_path = "mri_image.tif"  # Optional, if available
+    analyze_mask_tif(mask_tif_path, original_mri_tif_path)
 
-# Example usage
-mask_tif_path = "tumor_mask.tif"  # Replace with actual .tif mask path
-original_mri_tif_path = "mri_image.tif"  # Optional, if available
-analyze_mask_tif(mask_tif_path, original_mri_tif_path)
+if __name__ == '__main__':
+    main()